@@ -118,9 +118,19 @@ def load_python_bindings(python_input: PythonInput) -> KeyBindings:
         """
         event.app.current_buffer.insert_text("    ")
 
+    # The last document that `is_multiline` looked at, and the outcome. Both
+    # "enter" bindings evaluate it for the same key press, and the buffer
+    # returns the same `Document` as long as nothing changes.
+    last_multiline: tuple[Document | None, bool] = (None, False)
+
     @Condition
     def is_multiline() -> bool:
-        return document_is_multiline_python(python_input.default_buffer.document)
+        nonlocal last_multiline
+        document = python_input.default_buffer.document
+
+        if last_multiline[0] is not document:
+            last_multiline = (document, document_is_multiline_python(document))
+        return last_multiline[1]
 
     @handle(
         "enter",
@@ -5,7 +5,6 @@ from typing import Callable
 from prompt_toolkit.document import Document
 from prompt_toolkit.formatted_text import StyleAndTextTuples
 from prompt_toolkit.lexers import Lexer, PygmentsLexer
-from pygments.lexers import BashLexer
 from pygments.lexers import Python3Lexer as PythonLexer
 
 __all__ = ["PtpythonLexer"]
@@ -17,11 +16,22 @@ class PtpythonLexer(Lexer):
 
     If the input starts with an exclamation mark, use a Bash lexer, otherwise,
     use a Python 3 lexer.
+
+    The Bash lexer is only created (and its Pygments module imported) the
+    first time a system command is typed.
     """
 
     def __init__(self, python_lexer: Lexer | None = None) -> None:
         self.python_lexer = python_lexer or PygmentsLexer(PythonLexer)
-        self.system_lexer = PygmentsLexer(BashLexer)
+        self._system_lexer: Lexer | None = None
+
+    @property
+    def system_lexer(self) -> Lexer:
+        if self._system_lexer is None:
+            from pygments.lexers.shell import BashLexer
+
+            self._system_lexer = PygmentsLexer(BashLexer)
+        return self._system_lexer
 
     def lex_document(self, document: Document) -> Callable[[int], StyleAndTextTuples]:
         if document.text.startswith("!"):
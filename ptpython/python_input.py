@@ -5,9 +5,23 @@ This can be used for creation of Python REPLs.
 
 from __future__ import annotations
 
-from asyncio import get_running_loop
+from asyncio import Future, Task, TimerHandle, get_running_loop
+from collections import OrderedDict
+from concurrent.futures import Future as ConcurrentFuture
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import TYPE_CHECKING, Any, Callable, Dict, Generic, Mapping, TypeVar, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Mapping,
+    Sequence,
+    TypeVar,
+    Union,
+)
 
 from prompt_toolkit.application import Application, get_app
 from prompt_toolkit.auto_suggest import (
@@ -18,7 +32,7 @@ from prompt_toolkit.auto_suggest import (
 from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.completion import (
     Completer,
-    ConditionalCompleter,
+    DeduplicateCompleter,
     DynamicCompleter,
     FuzzyCompleter,
     ThreadedCompleter,
@@ -61,17 +75,16 @@ from prompt_toolkit.lexers import DynamicLexer, Lexer, SimpleLexer
 from prompt_toolkit.output import ColorDepth, Output
 from prompt_toolkit.styles import (
     AdjustBrightnessStyleTransformation,
+    Attrs,
     BaseStyle,
-    ConditionalStyleTransformation,
     DynamicStyle,
+    StyleTransformation,
     SwapLightAndDarkStyleTransformation,
-    merge_style_transformations,
 )
 from prompt_toolkit.utils import is_windows
 from prompt_toolkit.validation import ConditionalValidator, Validator
 
 from .completer import CompletePrivateAttributes, HidePrivateCompleter, PythonCompleter
-from .history_browser import PythonHistory
 from .key_bindings import (
     load_confirm_exit_bindings,
     load_python_bindings,
@@ -80,8 +93,18 @@ from .key_bindings import (
 from .layout import CompletionVisualisation, PtPythonLayout
 from .lexer import PtpythonLexer
 from .prompt_style import ClassicPrompt, IPythonPrompt, PromptStyle
-from .signatures import Signature, get_signatures_using_eval, get_signatures_using_jedi
-from .style import generate_style, get_all_code_styles, get_all_ui_styles
+from .signatures import (
+    Signature,
+    get_signatures_using_eval,
+    get_signatures_using_jedi,
+    maybe_in_function_call,
+)
+from .style import (
+    generate_style,
+    get_all_code_styles,
+    get_all_ui_styles,
+    get_code_style,
+)
 from .utils import unindent_code
 from .validator import PythonValidator
 
@@ -107,9 +130,11 @@ _T_kh = TypeVar("_T_kh", bound=Union[KeyHandlerCallable, Binding])
 
 
 class OptionCategory(Generic[_T_lt]):
-    def __init__(self, title: str, options: list[Option[_T_lt]]) -> None:
+    __slots__ = ("title", "options")
+
+    def __init__(self, title: str, options: Sequence[Option[_T_lt]]) -> None:
         self.title = title
-        self.options = options
+        self.options: tuple[Option[_T_lt], ...] = tuple(options)
 
 
 class Option(Generic[_T_lt]):
@@ -124,6 +149,16 @@ class Option(Generic[_T_lt]):
     :param get_current_value: Callable that returns the current, active value.
     """
 
+    __slots__ = (
+        "title",
+        "description",
+        "get_current_value",
+        "get_values",
+        "_cached_values",
+        "_sorted_keys",
+        "_key_indexes",
+    )
+
     def __init__(
         self,
         title: str,
@@ -138,22 +173,53 @@ class Option(Generic[_T_lt]):
         self.get_current_value = get_current_value
         self.get_values = get_values
 
+        # Sorted keys of the last mapping returned by `get_values`, and the
+        # position of each key in that list.
+        self._cached_values: Mapping[_T_lt, Callable[[], object]] | None = None
+        self._sorted_keys: list[_T_lt] = []
+        self._key_indexes: dict[_T_lt, int] = {}
+
     @property
     def values(self) -> Mapping[_T_lt, Callable[[], object]]:
         return self.get_values()
 
+    def _get_sorted_keys(
+        self, values: Mapping[_T_lt, Callable[[], object]]
+    ) -> list[_T_lt]:
+        """
+        Return the sorted keys of `values`. Most options return the same
+        mapping every time, so only sort again when we get a different one.
+        """
+        if values is not self._cached_values:
+            self._sorted_keys = sorted(values.keys())
+            self._key_indexes = {key: i for i, key in enumerate(self._sorted_keys)}
+            self._cached_values = values
+        return self._sorted_keys
+
     def activate_next(self, _previous: bool = False) -> None:
         """
         Activate next value.
         """
+        values = self.values
+
+        # Nothing to cycle through. Don't call the handler, because activating
+        # a value can be expensive. (E.g., regenerating the style.)
+        if len(values) <= 1:
+            return
+
         current = self.get_current_value()
-        options = sorted(self.values.keys())
+
+        # On/off options: forward and backward both mean "the other one".
+        if len(values) == 2 and current in values:
+            for key, handler in values.items():
+                if key != current:
+                    handler()
+                    return
+
+        options = self._get_sorted_keys(values)
 
         # Get current index.
-        try:
-            index = options.index(current)
-        except ValueError:
-            index = 0
+        index = self._key_indexes.get(current, 0)
 
         # Go to previous/next index.
         if _previous:
@@ -163,7 +229,7 @@ class Option(Generic[_T_lt]):
 
         # Call handler for this option.
         next_option = options[index % len(options)]
-        self.values[next_option]()
+        values[next_option]()
 
     def activate_previous(self) -> None:
         """
@@ -179,10 +245,134 @@ COLOR_DEPTHS = {
     ColorDepth.DEPTH_24_BIT: "True color",
 }
 
+# These key bindings don't depend on the `PythonInput` instance, so they can
+# be shared by all applications.
+_AUTO_SUGGEST_BINDINGS = load_auto_suggest_bindings()
+_OPEN_IN_EDITOR_BINDINGS = load_open_in_editor_bindings()
+
+
+class PtPythonStyleTransformation(StyleTransformation):
+    """
+    Style transformation that applies the "swap light/dark" and brightness
+    settings of the given `PythonInput`.
+
+    This reads the settings directly, instead of going through a merged list
+    of conditional transformations that evaluate a filter for every style.
+    """
+
+    def __init__(self, python_input: PythonInput) -> None:
+        self.python_input = python_input
+        self._swap_light_and_dark = SwapLightAndDarkStyleTransformation()
+        self._adjust_brightness = AdjustBrightnessStyleTransformation(
+            lambda: python_input.min_brightness, lambda: python_input.max_brightness
+        )
+
+        # Brightness adjusted attrs, for the brightness range in
+        # `_brightness_cache_range`. (The HLS conversion is the expensive
+        # part of the transformation, and is a pure function of these.)
+        self._brightness_cache: dict[Attrs, Attrs] = {}
+        self._brightness_cache_range: tuple[float, float] = (0.0, 1.0)
+
+    def transform_attrs(self, attrs: Attrs) -> Attrs:
+        python_input = self.python_input
+
+        if python_input.swap_light_and_dark:
+            attrs = self._swap_light_and_dark.transform_attrs(attrs)
+
+        # With the default brightness range, there's nothing to adjust.
+        brightness_range = (python_input.min_brightness, python_input.max_brightness)
+        if brightness_range == (0.0, 1.0):
+            return attrs
+
+        if brightness_range != self._brightness_cache_range:
+            self._brightness_cache.clear()
+            self._brightness_cache_range = brightness_range
+
+        try:
+            return self._brightness_cache[attrs]
+        except KeyError:
+            result = self._adjust_brightness.transform_attrs(attrs)
+            self._brightness_cache[attrs] = result
+            return result
+
+    def invalidation_hash(self) -> Hashable:
+        python_input = self.python_input
+        return (
+            python_input.swap_light_and_dark,
+            python_input.min_brightness,
+            python_input.max_brightness,
+        )
+
+
 _Namespace = Dict[str, Any]
 _GetNamespace = Callable[[], _Namespace]
 
 
+def _signatures_key(signatures: list[Signature]) -> list[tuple[object, ...]]:
+    """
+    Everything that determines how `signatures` are displayed. (Used to avoid
+    redrawing when a lookup returns the signatures that we already have.)
+    """
+    return [
+        (
+            s.name,
+            s.index,
+            s.bracket_start,
+            s.returns,
+            [(p.name, p.kind, p.annotation, p.default) for p in s.parameters],
+            s.docstring,
+        )
+        for s in signatures
+    ]
+
+
+class _ThreadedStoreHistory(ThreadedHistory):
+    """
+    `ThreadedHistory` that also stores new entries in a background thread, so
+    that accepting input doesn't have to wait for the disk. (Which can be
+    slow, e.g. on a network file system.)
+    """
+
+    def __init__(self, history: History) -> None:
+        super().__init__(history)
+
+        # A single worker, so that entries are written in order. (Pending
+        # writes are still done when the interpreter exits.)
+        self._store_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ptpython-history"
+        )
+
+    def store_string(self, string: str) -> None:
+        try:
+            loop = get_running_loop()
+        except RuntimeError:
+            # Not called from the event loop. There's nowhere to report
+            # errors to later, so write directly.
+            self.history.store_string(string)
+            return
+
+        def done(future: ConcurrentFuture[None]) -> None:
+            # Don't lose failed writes (permissions, disk full, ...)
+            # silently: report them through the event loop's exception
+            # handler, like an exception raised while accepting the input.
+            exception = future.exception()
+            if exception is None:
+                return
+
+            context = {
+                "message": "Failed to store history entry",
+                "exception": exception,
+            }
+            try:
+                loop.call_soon_threadsafe(loop.call_exception_handler, context)
+            except RuntimeError:
+                # The loop is closed already. (The application has exited.)
+                loop.call_exception_handler(context)
+
+        future = self._store_executor.submit(self.history.store_string, string)
+        future.add_done_callback(done)
+
+
 class PythonInput:
     """
     Prompt for reading Python input.
@@ -228,21 +418,27 @@ class PythonInput:
             lambda: self.enable_dictionary_completion,
         )
 
+        completer = DynamicCompleter(lambda: self.completer)
+
+        # If fuzzy is enabled, first do fuzzy completion, but always add the
+        # non-fuzzy completions, if somehow the fuzzy completer didn't find
+        # them. (Due to the way the cursor position is moved in the fuzzy
+        # completer, some completions will not always be found by the fuzzy
+        # completer, but will be found with the normal completer.)
+        fuzzy_completer = merge_completers(
+            [FuzzyCompleter(completer), completer], deduplicate=True
+        )
+
+        # When fuzzy completion is disabled (the default), only deduplicate the
+        # normal completions. (This also drops completions that wouldn't
+        # change the text, like `print` when `print` was typed already.)
+        plain_completer = DeduplicateCompleter(completer)
+
         self._completer = HidePrivateCompleter(
-            # If fuzzy is enabled, first do fuzzy completion, but always add
-            # the non-fuzzy completions, if somehow the fuzzy completer didn't
-            # find them. (Due to the way the cursor position is moved in the
-            # fuzzy completer, some completions will not always be found by the
-            # fuzzy completer, but will be found with the normal completer.)
-            merge_completers(
-                [
-                    ConditionalCompleter(
-                        FuzzyCompleter(DynamicCompleter(lambda: self.completer)),
-                        Condition(lambda: self.enable_fuzzy_completion),
-                    ),
-                    DynamicCompleter(lambda: self.completer),
-                ],
-                deduplicate=True,
+            DynamicCompleter(
+                lambda: (
+                    fuzzy_completer if self.enable_fuzzy_completion else plain_completer
+                )
             ),
             lambda: self.complete_private_attributes,
         )
@@ -251,7 +447,7 @@ class PythonInput:
 
         self.history: History
         if history_filename:
-            self.history = ThreadedHistory(FileHistory(history_filename))
+            self.history = _ThreadedStoreHistory(FileHistory(history_filename))
         else:
             self.history = InMemoryHistory()
 
@@ -321,6 +517,38 @@ class PythonInput:
         self.insert_blank_line_after_output: bool = True  # (For the REPL.)
         self.insert_blank_line_after_input: bool = False  # (For the REPL.)
 
+        # Filters for the settings above. These are created once and shared
+        # by the buffer and the application, rather than wrapping a new
+        # lambda each time.
+        self._complete_while_typing_filter = Condition(
+            lambda: self.complete_while_typing
+        )
+        self._enable_history_search_filter = Condition(
+            lambda: self.enable_history_search
+        )
+        self._enable_input_validation_filter = Condition(
+            lambda: self.enable_input_validation
+        )
+        self._enable_auto_suggest_filter = Condition(lambda: self.enable_auto_suggest)
+        self._enable_open_in_editor_filter = Condition(
+            lambda: self.enable_open_in_editor
+        )
+        self._paste_mode_filter = Condition(lambda: self.paste_mode)
+        self._enable_mouse_support_filter = Condition(lambda: self.enable_mouse_support)
+        self._sidebar_hidden_filter = Condition(lambda: not self.show_sidebar)
+
+        # Completer, validator and auto suggestion for the input buffer.
+        # (Shared by all buffers that `_create_buffer` creates, so that the
+        # wrappers don't have to be recreated.)
+        self._threaded_completer = ThreadedCompleter(self._completer)
+        self._conditional_validator = ConditionalValidator(
+            self._validator, self._enable_input_validation_filter
+        )
+        self._conditional_auto_suggest = ConditionalAutoSuggest(
+            ThreadedAutoSuggest(AutoSuggestFromHistory()),
+            self._enable_auto_suggest_filter,
+        )
+
         # The buffers.
         self.default_buffer = self._create_buffer()
         self.search_buffer: Buffer = Buffer()
@@ -348,7 +576,12 @@ class PythonInput:
         }
 
         #: Load styles.
-        self.code_styles: dict[str, BaseStyle] = get_all_code_styles()
+        self._style_cache: dict[tuple[BaseStyle, BaseStyle], BaseStyle] = {}
+        # Loading all the Pygments styles takes a while, so `code_styles` is
+        # only filled when it's first used. (Usually when the sidebar is
+        # shown.) Until then, only the styles in use are loaded.
+        self._code_styles: dict[str, BaseStyle] | None = None
+        self._loaded_code_styles: dict[str, BaseStyle] = {}
         self.ui_styles = get_all_ui_styles()
         self._current_code_style_name: str = "default"
         self._current_ui_style_name: str = "default"
@@ -356,25 +589,65 @@ class PythonInput:
         if is_windows():
             self._current_code_style_name = "win32"
 
-        self._current_style = self._generate_style()
+        # The style for the current color schemes. (Generated when it's
+        # needed, so that changing several color schemes at once only
+        # generates one style.)
+        self._style: BaseStyle | None = None
+        self._dynamic_style = DynamicStyle(lambda: self._current_style)
         self.color_depth: ColorDepth = color_depth or ColorDepth.default()
 
         self.max_brightness: float = 1.0
         self.min_brightness: float = 0.0
 
-        # Options to be configurable from the sidebar.
-        self.options = self._create_options()
+        # Options to be configurable from the sidebar. (These are created
+        # the first time they are needed.)
+        self._options: list[OptionCategory[Any]] | None = None
+
+        # All options in one list, for looking them up by index, and the
+        # (category, options) pairs from which that list was built. (The
+        # options list is public, so it can be changed after creation.)
+        self._flat_options: list[Option[Any]] = []
+        self._flat_options_source: list[
+            tuple[OptionCategory[Any], tuple[Option[Any], ...]]
+        ] = []
         self.selected_option_index: int = 0
 
         #: Incrementing integer counting the current statement.
         self.current_statement_index: int = 1
 
+        # Incremented every time the application is reset. Code that runs in
+        # between two inputs can change the namespaces, so caches that depend
+        # on them (compiler flags, signatures) are only valid for one
+        # generation.
+        self._namespace_generation: int = 0
+
+        # The globals and the generation for which we computed the compiler
+        # flags, and the flags themselves. See `get_compiler_flags`.
+        self._compiler_flags_cache: tuple[_Namespace | None, int, int] = (None, -1, 0)
+
         # Code signatures. (This is set asynchronously after a timeout.)
         self.signatures: list[Signature] = []
 
-        # Boolean indicating whether we have a signatures thread running.
-        # (Never run more than one at the same time.)
-        self._get_signatures_thread_running: bool = False
+        # Signatures are only looked up once there was no input activity for
+        # `_signatures_delay` seconds. This is the timer for the next lookup.
+        self._signatures_delay: float = 0.2
+        self._signatures_timer: TimerHandle | None = None
+
+        # Signature lookups get their own thread, so that they don't queue up
+        # behind completions and other work in the default executor.
+        self._signatures_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ptpython-signatures"
+        )
+        self._signatures_future: Future[list[Signature]] | None = None
+
+        # Recently found signatures, for going back to text that we've seen
+        # before. (Keyed by `_namespace_generation`, among others. Only
+        # accessed from the signatures executor.)
+        self._signatures_cache: OrderedDict[Hashable, list[Signature]] = OrderedDict()
+        self._signatures_cache_size: int = 64
+
+        # Task that displays the history. (See `enter_history`.)
+        self._history_task: Task[None] | None = None
 
         # Get into Vi navigation mode at startup
         self.vi_start_in_navigation_mode: bool = False
@@ -382,23 +655,16 @@ class PythonInput:
         # Preserve last used Vi input mode between main loop iterations
         self.vi_keep_last_used_mode: bool = False
 
-        self.style_transformation = merge_style_transformations(
-            [
-                ConditionalStyleTransformation(
-                    SwapLightAndDarkStyleTransformation(),
-                    filter=Condition(lambda: self.swap_light_and_dark),
-                ),
-                AdjustBrightnessStyleTransformation(
-                    lambda: self.min_brightness, lambda: self.max_brightness
-                ),
-            ]
-        )
+        self.style_transformation = PtPythonStyleTransformation(self)
+
+        # Use the same lexer instance when syntax highlighting is off. (The
+        # `DynamicLexer` is invalidated whenever the returned lexer changes.)
+        plain_lexer = SimpleLexer()
+
         self.ptpython_layout = PtPythonLayout(
             self,
             lexer=DynamicLexer(
-                lambda: self._lexer
-                if self.enable_syntax_highlighting
-                else SimpleLexer()
+                lambda: self._lexer if self.enable_syntax_highlighting else plain_lexer
             ),
             input_buffer_height=self._input_buffer_height,
             extra_buffer_processors=self._extra_buffer_processors,
@@ -429,21 +695,47 @@ class PythonInput:
         app.pre_run_callables.append(buff.reset)
         return True  # Keep text, we call 'reset' later on.
 
+    @property
+    def options(self) -> list[OptionCategory[Any]]:
+        "The options that are configurable from the sidebar."
+        if self._options is None:
+            self._options = self._create_options()
+        return self._options
+
+    @options.setter
+    def options(self, value: list[OptionCategory[Any]]) -> None:
+        self._options = value
+        self._flat_options = []
+        self._flat_options_source = []
+
+    def _get_flat_options(self) -> list[Option[Any]]:
+        """
+        Return all options of all categories in one list. This is rebuilt
+        when categories were added, removed or replaced, or when the options
+        of a category were replaced.
+        """
+        source = [(category, category.options) for category in self.options]
+
+        if source != self._flat_options_source:
+            self._flat_options = [
+                option for category in self.options for option in category.options
+            ]
+            self._flat_options_source = source
+        return self._flat_options
+
     @property
     def option_count(self) -> int:
         "Return the total amount of options. (In all categories together.)"
-        return sum(len(category.options) for category in self.options)
+        return len(self._get_flat_options())
 
     @property
     def selected_option(self) -> Option[Any]:
         "Return the currently selected option."
-        i = 0
-        for category in self.options:
-            for o in category.options:
-                if i == self.selected_option_index:
-                    return o
-                else:
-                    i += 1
+        flat_options = self._get_flat_options()
+        index = self.selected_option_index
+
+        if 0 <= index < len(flat_options):
+            return flat_options[index]
 
         raise ValueError("Nothing selected")
 
@@ -451,14 +743,30 @@ class PythonInput:
         """
         Give the current compiler flags by looking for _Feature instances
         in the globals.
+
+        This is called by the validator on every change of the input, so the
+        result is cached. The globals are scanned again for every new input
+        (code that ran in between can have imported features), or when a
+        different globals dictionary is used.
         """
+        globals = self.get_globals()
+        feature_type = __future__._Feature
+        cached_globals, cached_generation, cached_flags = self._compiler_flags_cache
+
+        if (
+            globals is cached_globals
+            and self._namespace_generation == cached_generation
+        ):
+            return cached_flags
+
         flags = 0
 
-        for value in self.get_globals().values():
+        for value in globals.values():
             try:
-                if isinstance(value, __future__._Feature):
-                    f = value.compiler_flag
-                    flags |= f
+                # Compare the type, rather than using `isinstance`. (This is
+                # faster, and doesn't look at `__class__`.)
+                if type(value) is feature_type:
+                    flags |= value.compiler_flag
             except BaseException:
                 # get_compiler_flags should never raise to not run into an
                 # `Unhandled exception in event loop`
@@ -468,6 +776,7 @@ class PythonInput:
                 # raise an exception in a custom `__getattribute__`.
                 pass
 
+        self._compiler_flags_cache = (globals, self._namespace_generation, flags)
         return flags
 
     def add_key_binding(
@@ -501,20 +810,56 @@ class PythonInput:
             record_in_macro=record_in_macro,
         )
 
+    @property
+    def code_styles(self) -> dict[str, BaseStyle]:
+        "All code styles, by name."
+        if self._code_styles is None:
+            code_styles = get_all_code_styles()
+
+            # Keep the instances that are in use already. (Their generated
+            # styles are cached by identity.)
+            code_styles.update(self._loaded_code_styles)
+            self._loaded_code_styles.clear()
+            self._code_styles = code_styles
+        return self._code_styles
+
+    @code_styles.setter
+    def code_styles(self, value: dict[str, BaseStyle]) -> None:
+        self._code_styles = value
+
+    def _get_code_style(self, name: str) -> BaseStyle:
+        """
+        Return the code style with this name, without loading all styles if
+        they haven't been loaded yet. Raises `KeyError` for unknown names.
+        """
+        if self._code_styles is not None:
+            return self._code_styles[name]
+
+        try:
+            return self._loaded_code_styles[name]
+        except KeyError:
+            style = self._loaded_code_styles[name] = get_code_style(name)
+            return style
+
     def install_code_colorscheme(self, name: str, style: BaseStyle) -> None:
         """
         Install a new code color scheme.
         """
-        self.code_styles[name] = style
+        if self._code_styles is None:
+            # Don't load all the Pygments styles for this. (They are merged
+            # with the installed ones once they are needed.)
+            self._loaded_code_styles[name] = style
+        else:
+            self._code_styles[name] = style
 
     def use_code_colorscheme(self, name: str) -> None:
         """
         Apply new colorscheme. (By name.)
         """
-        assert name in self.code_styles
+        self._get_code_style(name)  # Raises `KeyError` for unknown names.
 
         self._current_code_style_name = name
-        self._current_style = self._generate_style()
+        self._style = None
 
     def install_ui_colorscheme(self, name: str, style: BaseStyle) -> None:
         """
@@ -529,11 +874,17 @@ class PythonInput:
         assert name in self.ui_styles
 
         self._current_ui_style_name = name
-        self._current_style = self._generate_style()
+        self._style = None
 
     def _use_color_depth(self, depth: ColorDepth) -> None:
         self.color_depth = depth
 
+    def _get_color_depth(self) -> ColorDepth:
+        return self.color_depth
+
+    def _get_cursor_shape_config(self) -> AnyCursorShapeConfig:
+        return self.all_cursor_shape_configs[self.cursor_shape_config]
+
     def _set_min_brightness(self, value: float) -> None:
         self.min_brightness = value
         self.max_brightness = max(self.max_brightness, value)
@@ -542,16 +893,31 @@ class PythonInput:
         self.max_brightness = value
         self.min_brightness = min(self.min_brightness, value)
 
+    @property
+    def _current_style(self) -> BaseStyle:
+        if self._style is None:
+            self._style = self._generate_style()
+        return self._style
+
     def _generate_style(self) -> BaseStyle:
         """
         Create new Style instance.
         (We don't want to do this on every key press, because each time the
         renderer receives a new style class, he will redraw everything.)
+
+        Generated styles are cached by the code and UI style they were made
+        of, so that cycling through the color schemes in the sidebar doesn't
+        generate the same style again.
         """
-        return generate_style(
-            self.code_styles[self._current_code_style_name],
+        key = (
+            self._get_code_style(self._current_code_style_name),
             self.ui_styles[self._current_ui_style_name],
         )
+        try:
+            return self._style_cache[key]
+        except KeyError:
+            style = self._style_cache[key] = generate_style(*key)
+            return style
 
     def _create_options(self) -> list[OptionCategory[Any]]:
         """
@@ -575,24 +941,113 @@ class PythonInput:
             values: tuple[str, str] = ("off", "on"),
         ) -> Option[str]:
             "Create Simple on/of option."
+            off, on = values
 
-            def get_current_value() -> str:
-                return values[bool(getattr(self, field_name))]
+            values_dict: dict[str, Callable[[], bool]] = {
+                on: lambda: enable(field_name),
+                off: lambda: disable(field_name),
+            }
 
-            def get_values() -> dict[str, Callable[[], bool]]:
-                return {
-                    values[1]: lambda: enable(field_name),
-                    values[0]: lambda: disable(field_name),
-                }
+            def get_current_value() -> str:
+                return on if getattr(self, field_name) else off
 
             return Option(
                 title=title,
                 description=description,
-                get_values=get_values,
+                get_values=lambda: values_dict,
                 get_current_value=get_current_value,
             )
 
-        brightness_values = [1.0 / 20 * value for value in range(0, 21)]
+        def values_by_name(
+            get_dict: Callable[[], Mapping[str, object]],
+            select: Callable[[str], object],
+        ) -> Callable[[], dict[str, Callable[[], object]]]:
+            """
+            Create a `get_values` function for an option that selects one of
+            the names in a dictionary that can change at runtime. (E.g. when
+            a color scheme is installed.) The mapping is only rebuilt when the
+            names in this dictionary change.
+            """
+            names: set[str] = set()
+            values: dict[str, Callable[[], object]] = {}
+
+            def get_values() -> dict[str, Callable[[], object]]:
+                nonlocal names, values
+                d = get_dict()
+
+                if d.keys() != names:
+                    names = set(d)
+                    values = {name: partial(select, name) for name in d}
+                return values
+
+            return get_values
+
+        # Value mappings that don't depend on runtime state are created once,
+        # rather than each time the sidebar asks for them.
+        editing_mode_values = {
+            "Emacs": lambda: disable("vi_mode"),
+            "Vi": lambda: enable("vi_mode"),
+        }
+        complete_while_typing_values = {
+            "on": lambda: (
+                enable("complete_while_typing") and disable("enable_history_search")
+            ),
+            "off": lambda: disable("complete_while_typing"),
+        }
+        complete_private_attributes_labels = {
+            CompletePrivateAttributes.NEVER: "Never",
+            CompletePrivateAttributes.ALWAYS: "Always",
+            CompletePrivateAttributes.IF_NO_PUBLIC: "If no public",
+        }
+        complete_private_attributes_values = {
+            label: partial(enable, "complete_private_attributes", value)
+            for value, label in complete_private_attributes_labels.items()
+        }
+        fuzzy_completion_values = {
+            "on": lambda: enable("enable_fuzzy_completion"),
+            "off": lambda: disable("enable_fuzzy_completion"),
+        }
+        dictionary_completion_values = {
+            "on": lambda: enable("enable_dictionary_completion"),
+            "off": lambda: disable("enable_dictionary_completion"),
+        }
+        history_search_values = {
+            "on": lambda: (
+                enable("enable_history_search") and disable("complete_while_typing")
+            ),
+            "off": lambda: disable("enable_history_search"),
+        }
+        accept_input_on_enter_values = {
+            "2": lambda: enable("accept_input_on_enter", 2),
+            "3": lambda: enable("accept_input_on_enter", 3),
+            "4": lambda: enable("accept_input_on_enter", 4),
+            "meta-enter": lambda: enable("accept_input_on_enter", None),
+        }
+        completion_visualisation_values = {
+            v.value: partial(enable, "completion_visualisation", v)
+            for v in CompletionVisualisation
+        }
+        color_depth_values = {
+            name: partial(self._use_color_depth, depth)
+            for depth, name in COLOR_DEPTHS.items()
+        }
+        brightness_labels = {
+            value: f"{value:.2f}" for value in (1.0 / 20 * i for i in range(0, 21))
+        }
+        min_brightness_values = {
+            label: partial(self._set_min_brightness, value)
+            for value, label in brightness_labels.items()
+        }
+        max_brightness_values = {
+            label: partial(self._set_max_brightness, value)
+            for value, label in brightness_labels.items()
+        }
+
+        def brightness_label(value: float) -> str:
+            # The sidebar asks for this on every render; only format values
+            # that were set from outside the sidebar (e.g. in the config).
+            label = brightness_labels.get(value)
+            return f"{value:.2f}" if label is None else label
 
         return [
             OptionCategory(
@@ -601,21 +1056,18 @@ class PythonInput:
                     Option(
                         title="Editing mode",
                         description="Vi or emacs key bindings.",
-                        get_current_value=lambda: ["Emacs", "Vi"][self.vi_mode],
-                        get_values=lambda: {
-                            "Emacs": lambda: disable("vi_mode"),
-                            "Vi": lambda: enable("vi_mode"),
-                        },
+                        get_current_value=lambda: "Vi" if self.vi_mode else "Emacs",
+                        get_values=lambda: editing_mode_values,
                     ),
                     Option(
                         title="Cursor shape",
                         description="Change the cursor style, possibly according "
                         "to the Vi input mode.",
                         get_current_value=lambda: self.cursor_shape_config,
-                        get_values=lambda: {
-                            s: partial(enable, "cursor_shape_config", s)
-                            for s in self.all_cursor_shape_configs
-                        },
+                        get_values=values_by_name(
+                            lambda: self.all_cursor_shape_configs,
+                            partial(enable, "cursor_shape_config"),
+                        ),
                     ),
                     simple_option(
                         title="Paste mode",
@@ -626,50 +1078,28 @@ class PythonInput:
                         title="Complete while typing",
                         description="Generate autocompletions automatically while typing. "
                         'Don\'t require pressing TAB. (Not compatible with "History search".)',
-                        get_current_value=lambda: ["off", "on"][
-                            self.complete_while_typing
-                        ],
-                        get_values=lambda: {
-                            "on": lambda: enable("complete_while_typing")
-                            and disable("enable_history_search"),
-                            "off": lambda: disable("complete_while_typing"),
-                        },
+                        get_current_value=lambda: (
+                            "on" if self.complete_while_typing else "off"
+                        ),
+                        get_values=lambda: complete_while_typing_values,
                     ),
                     Option(
                         title="Complete private attrs",
                         description="Show or hide private attributes in the completions. "
                         "'If no public' means: show private attributes only if no public "
                         "matches are found or if an underscore was typed.",
-                        get_current_value=lambda: {
-                            CompletePrivateAttributes.NEVER: "Never",
-                            CompletePrivateAttributes.ALWAYS: "Always",
-                            CompletePrivateAttributes.IF_NO_PUBLIC: "If no public",
-                        }[self.complete_private_attributes],
-                        get_values=lambda: {
-                            "Never": lambda: enable(
-                                "complete_private_attributes",
-                                CompletePrivateAttributes.NEVER,
-                            ),
-                            "Always": lambda: enable(
-                                "complete_private_attributes",
-                                CompletePrivateAttributes.ALWAYS,
-                            ),
-                            "If no public": lambda: enable(
-                                "complete_private_attributes",
-                                CompletePrivateAttributes.IF_NO_PUBLIC,
-                            ),
-                        },
+                        get_current_value=lambda: complete_private_attributes_labels[
+                            self.complete_private_attributes
+                        ],
+                        get_values=lambda: complete_private_attributes_values,
                     ),
                     Option(
                         title="Enable fuzzy completion",
                         description="Enable fuzzy completion.",
-                        get_current_value=lambda: ["off", "on"][
-                            self.enable_fuzzy_completion
-                        ],
-                        get_values=lambda: {
-                            "on": lambda: enable("enable_fuzzy_completion"),
-                            "off": lambda: disable("enable_fuzzy_completion"),
-                        },
+                        get_current_value=lambda: (
+                            "on" if self.enable_fuzzy_completion else "off"
+                        ),
+                        get_values=lambda: fuzzy_completion_values,
                     ),
                     Option(
                         title="Dictionary completion",
@@ -677,26 +1107,19 @@ class PythonInput:
                         'WARNING: this does "eval" on fragments of\n'
                         "         your Python input and is\n"
                         "         potentially unsafe.",
-                        get_current_value=lambda: ["off", "on"][
-                            self.enable_dictionary_completion
-                        ],
-                        get_values=lambda: {
-                            "on": lambda: enable("enable_dictionary_completion"),
-                            "off": lambda: disable("enable_dictionary_completion"),
-                        },
+                        get_current_value=lambda: (
+                            "on" if self.enable_dictionary_completion else "off"
+                        ),
+                        get_values=lambda: dictionary_completion_values,
                     ),
                     Option(
                         title="History search",
                         description="When pressing the up-arrow, filter the history on input starting "
                         'with the current text. (Not compatible with "Complete while typing".)',
-                        get_current_value=lambda: ["off", "on"][
-                            self.enable_history_search
-                        ],
-                        get_values=lambda: {
-                            "on": lambda: enable("enable_history_search")
-                            and disable("complete_while_typing"),
-                            "off": lambda: disable("enable_history_search"),
-                        },
+                        get_current_value=lambda: (
+                            "on" if self.enable_history_search else "off"
+                        ),
+                        get_values=lambda: history_search_values,
                     ),
                     simple_option(
                         title="Mouse support",
@@ -728,12 +1151,7 @@ class PythonInput:
                         get_current_value=lambda: str(
                             self.accept_input_on_enter or "meta-enter"
                         ),
-                        get_values=lambda: {
-                            "2": lambda: enable("accept_input_on_enter", 2),
-                            "3": lambda: enable("accept_input_on_enter", 3),
-                            "4": lambda: enable("accept_input_on_enter", 4),
-                            "meta-enter": lambda: enable("accept_input_on_enter", None),
-                        },
+                        get_values=lambda: accept_input_on_enter_values,
                     ),
                 ],
             ),
@@ -744,32 +1162,16 @@ class PythonInput:
                         title="Completions",
                         description="Visualisation to use for displaying the completions. (Multiple columns, one column, a toolbar or nothing.)",
                         get_current_value=lambda: self.completion_visualisation.value,
-                        get_values=lambda: {
-                            CompletionVisualisation.NONE.value: lambda: enable(
-                                "completion_visualisation", CompletionVisualisation.NONE
-                            ),
-                            CompletionVisualisation.POP_UP.value: lambda: enable(
-                                "completion_visualisation",
-                                CompletionVisualisation.POP_UP,
-                            ),
-                            CompletionVisualisation.MULTI_COLUMN.value: lambda: enable(
-                                "completion_visualisation",
-                                CompletionVisualisation.MULTI_COLUMN,
-                            ),
-                            CompletionVisualisation.TOOLBAR.value: lambda: enable(
-                                "completion_visualisation",
-                                CompletionVisualisation.TOOLBAR,
-                            ),
-                        },
+                        get_values=lambda: completion_visualisation_values,
                     ),
                     Option(
                         title="Prompt",
                         description="Visualisation of the prompt. ('>>>' or 'In [1]:')",
                         get_current_value=lambda: self.prompt_style,
-                        get_values=lambda: {
-                            s: partial(enable, "prompt_style", s)
-                            for s in self.all_prompt_styles
-                        },
+                        get_values=values_by_name(
+                            lambda: self.all_prompt_styles,
+                            partial(enable, "prompt_style"),
+                        ),
                     ),
                     simple_option(
                         title="Blank line after input",
@@ -852,46 +1254,35 @@ class PythonInput:
                         title="Code",
                         description="Color scheme to use for the Python code.",
                         get_current_value=lambda: self._current_code_style_name,
-                        get_values=lambda: {
-                            name: partial(self.use_code_colorscheme, name)
-                            for name in self.code_styles
-                        },
+                        get_values=values_by_name(
+                            lambda: self.code_styles, self.use_code_colorscheme
+                        ),
                     ),
                     Option(
                         title="User interface",
                         description="Color scheme to use for the user interface.",
                         get_current_value=lambda: self._current_ui_style_name,
-                        get_values=lambda: {
-                            name: partial(self.use_ui_colorscheme, name)
-                            for name in self.ui_styles
-                        },
+                        get_values=values_by_name(
+                            lambda: self.ui_styles, self.use_ui_colorscheme
+                        ),
                     ),
                     Option(
                         title="Color depth",
                         description="Monochrome (1 bit), 16 ANSI colors (4 bit),\n256 colors (8 bit), or 24 bit.",
                         get_current_value=lambda: COLOR_DEPTHS[self.color_depth],
-                        get_values=lambda: {
-                            name: partial(self._use_color_depth, depth)
-                            for depth, name in COLOR_DEPTHS.items()
-                        },
+                        get_values=lambda: color_depth_values,
                     ),
                     Option(
                         title="Min brightness",
                         description="Minimum brightness for the color scheme (default=0.0).",
-                        get_current_value=lambda: f"{self.min_brightness:.2f}",
-                        get_values=lambda: {
-                            f"{value:.2f}": partial(self._set_min_brightness, value)
-                            for value in brightness_values
-                        },
+                        get_current_value=lambda: brightness_label(self.min_brightness),
+                        get_values=lambda: min_brightness_values,
                     ),
                     Option(
                         title="Max brightness",
                         description="Maximum brightness for the color scheme (default=1.0).",
-                        get_current_value=lambda: f"{self.max_brightness:.2f}",
-                        get_values=lambda: {
-                            f"{value:.2f}": partial(self._set_max_brightness, value)
-                            for value in brightness_values
-                        },
+                        get_current_value=lambda: brightness_label(self.max_brightness),
+                        get_values=lambda: max_brightness_values,
                     ),
                 ],
             ),
@@ -908,52 +1299,52 @@ class PythonInput:
             key_bindings=merge_key_bindings(
                 [
                     load_python_bindings(self),
-                    load_auto_suggest_bindings(),
+                    _AUTO_SUGGEST_BINDINGS,
                     load_sidebar_bindings(self),
                     load_confirm_exit_bindings(self),
                     ConditionalKeyBindings(
-                        load_open_in_editor_bindings(),
-                        Condition(lambda: self.enable_open_in_editor),
+                        _OPEN_IN_EDITOR_BINDINGS,
+                        self._enable_open_in_editor_filter,
                     ),
                     # Extra key bindings should not be active when the sidebar is visible.
                     ConditionalKeyBindings(
                         self.extra_key_bindings,
-                        Condition(lambda: not self.show_sidebar),
+                        self._sidebar_hidden_filter,
                     ),
                 ]
             ),
-            color_depth=lambda: self.color_depth,
-            paste_mode=Condition(lambda: self.paste_mode),
-            mouse_support=Condition(lambda: self.enable_mouse_support),
-            style=DynamicStyle(lambda: self._current_style),
+            color_depth=self._get_color_depth,
+            paste_mode=self._paste_mode_filter,
+            mouse_support=self._enable_mouse_support_filter,
+            style=self._dynamic_style,
             style_transformation=self.style_transformation,
             include_default_pygments_style=False,
             reverse_vi_search_direction=True,
-            cursor=DynamicCursorShapeConfig(
-                lambda: self.all_cursor_shape_configs[self.cursor_shape_config]
-            ),
+            cursor=DynamicCursorShapeConfig(self._get_cursor_shape_config),
+            on_reset=self._on_application_reset,
             input=input,
             output=output,
         )
 
+    def _on_application_reset(self, app: Application[str]) -> None:
+        # Code executed since the last input can have changed the
+        # namespaces, so don't reuse compiler flags or signatures that were
+        # found before.
+        self._namespace_generation += 1
+
     def _create_buffer(self) -> Buffer:
         """
         Create the `Buffer` for the Python input.
         """
         python_buffer = Buffer(
             name=DEFAULT_BUFFER,
-            complete_while_typing=Condition(lambda: self.complete_while_typing),
-            enable_history_search=Condition(lambda: self.enable_history_search),
+            complete_while_typing=self._complete_while_typing_filter,
+            enable_history_search=self._enable_history_search_filter,
             tempfile_suffix=".py",
             history=self.history,
-            completer=ThreadedCompleter(self._completer),
-            validator=ConditionalValidator(
-                self._validator, Condition(lambda: self.enable_input_validation)
-            ),
-            auto_suggest=ConditionalAutoSuggest(
-                ThreadedAutoSuggest(AutoSuggestFromHistory()),
-                Condition(lambda: self.enable_auto_suggest),
-            ),
+            completer=self._threaded_completer,
+            validator=self._conditional_validator,
+            auto_suggest=self._conditional_auto_suggest,
             accept_handler=self._accept_handler,
             on_text_changed=self._on_input_timeout,
         )
@@ -991,17 +1382,48 @@ class PythonInput:
         in another thread, get the signature of the current code.
         """
 
-        def get_signatures_in_executor(document: Document) -> list[Signature]:
+        def get_signatures_in_executor(
+            document: Document, generation: int
+        ) -> list[Signature]:
+            locals = self.get_locals()
+            globals = self.get_globals()
+            enable_dictionary_completion = self.enable_dictionary_completion
+
+            cache = self._signatures_cache
+            key = (
+                generation,
+                document.text,
+                document.cursor_position,
+                id(locals),
+                id(globals),
+                enable_dictionary_completion,
+            )
+            try:
+                signatures = cache[key]
+            except KeyError:
+                pass
+            else:
+                cache.move_to_end(key)
+                return signatures
+
+            # If the text changed while this lookup was waiting or running,
+            # the result will be thrown away. Stop early in that case. (This
+            # is checked in between the steps, Jedi itself can't be stopped.)
+            if buff.text != document.text:
+                return []
+
             # First, get signatures from Jedi. If we didn't found any and if
             # "dictionary completion" (eval-based completion) is enabled, then
             # get signatures using eval.
-            signatures = get_signatures_using_jedi(
-                document, self.get_locals(), self.get_globals()
-            )
-            if not signatures and self.enable_dictionary_completion:
-                signatures = get_signatures_using_eval(
-                    document, self.get_locals(), self.get_globals()
-                )
+            signatures = get_signatures_using_jedi(document, locals, globals)
+            if not signatures and enable_dictionary_completion:
+                if buff.text != document.text:
+                    return []
+                signatures = get_signatures_using_eval(document, locals, globals)
+
+            cache[key] = signatures
+            if len(cache) > self._signatures_cache_size:
+                cache.popitem(last=False)
 
             return signatures
 
@@ -1009,41 +1431,73 @@ class PythonInput:
 
         async def on_timeout_task() -> None:
             loop = get_running_loop()
+            document = buff.document
 
-            # Never run multiple get-signature threads.
-            if self._get_signatures_thread_running:
-                return
-            self._get_signatures_thread_running = True
+            # A lookup that hasn't started yet is outdated, drop it.
+            if self._signatures_future is not None:
+                self._signatures_future.cancel()
 
-            try:
-                while True:
-                    document = buff.document
-                    signatures = await loop.run_in_executor(
-                        None, get_signatures_in_executor, document
-                    )
-
-                    # If the text didn't change in the meantime, take these
-                    # signatures. Otherwise, try again.
-                    if buff.text == document.text:
-                        break
-            finally:
-                self._get_signatures_thread_running = False
-
-            # Set signatures and redraw.
-            self.signatures = signatures
+            self._signatures_future = loop.run_in_executor(
+                self._signatures_executor,
+                get_signatures_in_executor,
+                document,
+                self._namespace_generation,
+            )
+            signatures = await self._signatures_future
+            self._apply_signatures(buff, document, signatures)
+
+        def on_timeout() -> None:
+            self._signatures_timer = None
+            if app.is_running:
+                app.create_background_task(on_timeout_task())
+
+        # Restart the timer on every change, so that we don't run Jedi for
+        # every key press while typing.
+        if self._signatures_timer is not None:
+            self._signatures_timer.cancel()
+            self._signatures_timer = None
+
+        # If all parentheses before the cursor are closed, we can't be in a
+        # function call. Don't bother Jedi with parsing the input in that case.
+        document = buff.document
+        if not maybe_in_function_call(document.text_before_cursor):
+            if self.signatures:
+                self._apply_signatures(buff, document, [])
+            return
+
+        if app.is_running and app.loop is not None:
+            self._signatures_timer = app.loop.call_later(
+                self._signatures_delay, on_timeout
+            )
 
-            # Set docstring in docstring buffer.
-            if signatures:
-                self.docstring_buffer.reset(
-                    document=Document(signatures[0].docstring, cursor_position=0)
-                )
-            else:
-                self.docstring_buffer.reset()
+    def _apply_signatures(
+        self, buff: Buffer, document: Document, signatures: list[Signature]
+    ) -> None:
+        """
+        Show the signatures that were found for `document`. (Called from the
+        event loop thread.)
+        """
+        # If the text changed in the meantime, these signatures are
+        # outdated. (Another lookup has been scheduled for the new text.)
+        if buff.text != document.text:
+            return
 
-            app.invalidate()
+        # Only redraw if something changed. (Often, the same signature is
+        # found again while typing the arguments.)
+        changed = False
 
-        if app.is_running:
-            app.create_background_task(on_timeout_task())
+        if _signatures_key(signatures) != _signatures_key(self.signatures):
+            self.signatures = signatures
+            changed = True
+
+        # Set docstring in docstring buffer, unless it's already there.
+        docstring = signatures[0].docstring if signatures else ""
+        if docstring != self.docstring_buffer.text:
+            self.docstring_buffer.reset(document=Document(docstring, cursor_position=0))
+            changed = True
+
+        if changed:
+            self.app.invalidate()
 
     def on_reset(self) -> None:
         self.signatures = []
@@ -1052,15 +1506,21 @@ class PythonInput:
         """
         Display the history.
         """
+        # The history is already being displayed.
+        if self._history_task is not None and not self._history_task.done():
+            return
+
+        # Imported here, because the history browser (and the Pygments lexers
+        # it uses) are only needed once the history is shown.
+        from prompt_toolkit.application import in_terminal
+
+        from .history_browser import PythonHistory
+
         app = self.app
         app.vi_state.input_mode = InputMode.NAVIGATION
 
         history = PythonHistory(self, self.default_buffer.document)
 
-        import asyncio
-
-        from prompt_toolkit.application import in_terminal
-
         async def do_in_terminal() -> None:
             async with in_terminal():
                 result = await history.app.run_async()
@@ -1069,7 +1529,9 @@ class PythonInput:
 
                 app.vi_state.input_mode = InputMode.INSERT
 
-        asyncio.ensure_future(do_in_terminal())
+        # As a background task of the application, exceptions are reported
+        # instead of being lost with an unreferenced future.
+        self._history_task = app.create_background_task(do_in_terminal())
 
     def read(self) -> str:
         """
@@ -9,6 +9,7 @@ can use `eval()` to evaluate the function object.
 from __future__ import annotations
 
 import inspect
+import re
 from inspect import Signature as InspectSignature
 from inspect import _ParameterKind as ParameterKind
 from typing import TYPE_CHECKING, Any, Sequence
@@ -21,7 +22,12 @@ from .utils import get_jedi_script_from_document
 if TYPE_CHECKING:
     import jedi.api.classes
 
-__all__ = ["Signature", "get_signatures_using_jedi", "get_signatures_using_eval"]
+__all__ = [
+    "Signature",
+    "get_signatures_using_jedi",
+    "get_signatures_using_eval",
+    "maybe_in_function_call",
+]
 
 
 class Parameter:
@@ -143,13 +149,9 @@ class Signature:
                 )
             )
 
-        docstring = signature.docstring()
-        if not isinstance(docstring, str):
-            docstring = docstring.decode("utf-8")
-
         return cls(
             name=signature.name,
-            docstring=docstring,
+            docstring=signature.docstring(),
             parameters=parameters,
             index=signature.index,
             returns="",
@@ -160,6 +162,49 @@ class Signature:
         return f"Signature({self.name!r}, parameters={self.parameters!r})"
 
 
+# Parentheses, comments and strings. For strings, the closing quotes are
+# captured in a group, so that we know whether the string was terminated.
+_PAREN_SCAN_RE = re.compile(
+    "|".join(
+        [
+            r"[()]",
+            r"#[^\n]*",
+            r"'''(?:\\.|[^\\])*?(?:(''')|\Z)",
+            r'"""(?:\\.|[^\\])*?(?:(""")|\Z)',
+            r"'(?:\\.|[^\\'\n])*(')?",
+            r'"(?:\\.|[^\\"\n])*(")?',
+        ]
+    ),
+    re.DOTALL,
+)
+
+
+def maybe_in_function_call(text: str) -> bool:
+    """
+    Return `False` if the end of `text` can't be inside a function call,
+    because every opening parenthesis (outside of strings and comments) has
+    been closed. This is a lot cheaper than asking Jedi.
+
+    When `text` ends in a string or comment, we can't tell (think of
+    f-strings), so we return `True`.
+    """
+    if "(" not in text:
+        return False
+
+    depth = 0
+    for m in _PAREN_SCAN_RE.finditer(text):
+        token = m.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif m.end() == len(text) and (token.startswith("#") or m.lastindex is None):
+            # Cursor is in a comment or unterminated string.
+            return True
+
+    return depth > 0
+
+
 def get_signatures_using_jedi(
     document: Document, locals: dict[str, Any], globals: dict[str, Any]
 ) -> list[Signature]:
@@ -179,18 +224,6 @@ def get_signatures_using_jedi(
         # of probably bugs in jedi. We can silence them.
         # See: https://github.com/davidhalter/jedi/issues/492
         signatures = []
-    else:
-        # Try to access the params attribute just once. For Jedi
-        # signatures containing the keyword-only argument star,
-        # this will crash when retrieving it the first time with
-        # AttributeError. Every following time it works.
-        # See: https://github.com/jonathanslenders/ptpython/issues/47
-        #      https://github.com/davidhalter/jedi/issues/598
-        try:
-            if signatures:
-                signatures[0].params
-        except AttributeError:
-            pass
 
     return [Signature.from_jedi_signature(sig) for sig in signatures]
 
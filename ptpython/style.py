@@ -4,8 +4,14 @@ from prompt_toolkit.styles import BaseStyle, Style, merge_styles
 from prompt_toolkit.styles.pygments import style_from_pygments_cls
 from prompt_toolkit.utils import is_conemu_ansi, is_windows, is_windows_vt100_supported
 from pygments.styles import get_all_styles, get_style_by_name
+from pygments.util import ClassNotFound
 
-__all__ = ["get_all_code_styles", "get_all_ui_styles", "generate_style"]
+__all__ = [
+    "get_all_code_styles",
+    "get_code_style",
+    "get_all_ui_styles",
+    "generate_style",
+]
 
 
 def get_all_code_styles() -> dict[str, BaseStyle]:
@@ -20,6 +26,22 @@ def get_all_code_styles() -> dict[str, BaseStyle]:
     return result
 
 
+def get_code_style(name: str) -> BaseStyle:
+    """
+    Return the code style with the given name, without loading all the other
+    styles. Raises `KeyError` if there is no such style.
+    """
+    if name == "win32":
+        return Style.from_dict(win32_code_style)
+
+    try:
+        pygments_style = get_style_by_name(name)
+    except ClassNotFound:
+        raise KeyError(name) from None
+
+    return style_from_pygments_cls(pygments_style)
+
+
 def get_all_ui_styles() -> dict[str, BaseStyle]:
     """
     Return a dict mapping {ui_style_name -> style_dict}.
@@ -28,6 +28,10 @@ __all__ = [
 ]
 
 
+_strings_re = re.compile(r"""('[^']*'|"[^"]*")""")  # XXX: handle escaped quotes.!
+_brackets_re = re.compile(r"[\[\](){}]")
+
+
 def has_unclosed_brackets(text: str) -> bool:
     """
     Starting at the end of the string. If we find an opening bracket
@@ -36,9 +40,11 @@ def has_unclosed_brackets(text: str) -> bool:
     stack = []
 
     # Ignore braces inside strings
-    text = re.sub(r"""('[^']*'|"[^"]*")""", "", text)  # XXX: handle escaped quotes.!
+    text = _strings_re.sub("", text)
 
-    for c in reversed(text):
+    # Only look at the brackets. (Let the regex skip all other characters,
+    # rather than looping over them in Python.)
+    for c in reversed(_brackets_re.findall(text)):
         if c in "])}":
             stack.append(c)
 